@@ -0,0 +1,13 @@
+"""
+Optional numba support for numeric hot paths.
+When numba is not installed, njit leaves the decorated function as plain python / numpy.
+"""
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        # support both @njit and @njit(cache=True, ...)
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
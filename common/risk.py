@@ -1,9 +1,24 @@
 import math
 import numpy as np
 
+def _limit_property(bounds: str, index: int):
+    """
+    expose one entry of RiskLimit.lo / RiskLimit.hi as a scalar attribute
+    """
+    def getter(self):
+        return getattr(self, bounds)[index]
+
+    def setter(self, value):
+        getattr(self, bounds)[index] = value
+        self._update_active_index()
+
+    return property(getter, setter)
+
 class RiskLimit(object):
     """
     Unsigned, indicative of the maximum / minimum risk that can be taken.
+    Bounds are stored as lo / hi numpy vectors in the same order as Risk.vec (delta, gamma, theta, vega, rho).
+    Greeks bounded by (-inf, inf) are left out of active_index, so risk checks only compare the limits that are set.
     """
     def __init__(
             self,
@@ -18,16 +33,25 @@ class RiskLimit(object):
             min_rho=np.inf, 
             max_rho=np.inf
             ):
-        self.min_delta = min_delta
-        self.max_delta = max_delta
-        self.min_gamma = min_gamma
-        self.max_gamma = max_gamma
-        self.min_theta = min_theta
-        self.max_theta = max_theta
-        self.min_vega = min_vega
-        self.max_vega = max_vega
-        self.min_rho = min_rho
-        self.max_rho = max_rho
+        self.lo = np.array([min_delta, min_gamma, min_theta, min_vega, min_rho], dtype=np.float64)
+        self.hi = np.array([max_delta, max_gamma, max_theta, max_vega, max_rho], dtype=np.float64)
+        self._update_active_index()
+
+    def _update_active_index(self):
+        self.active_index = np.flatnonzero((self.lo > -np.inf) | (self.hi < np.inf))
+        self.active_lo = self.lo[self.active_index]
+        self.active_hi = self.hi[self.active_index]
+
+    min_delta = _limit_property("lo", 0)
+    max_delta = _limit_property("hi", 0)
+    min_gamma = _limit_property("lo", 1)
+    max_gamma = _limit_property("hi", 1)
+    min_theta = _limit_property("lo", 2)
+    max_theta = _limit_property("hi", 2)
+    min_vega = _limit_property("lo", 3)
+    max_vega = _limit_property("hi", 3)
+    min_rho = _limit_property("lo", 4)
+    max_rho = _limit_property("hi", 4)
 
     def __str__(self):
         return f"Risk-Limit: d: ({self.min_delta}, {self.max_delta}), g: ({self.min_gamma}, {self.max_gamma}), t: ({self.min_theta}, {self.max_theta}), v: ({self.min_vega}, {self.max_vega}), r: ({self.min_rho}, {self.max_rho})"
@@ -38,47 +62,89 @@ class RiskLimit(object):
 class Risk(object):
     """
     Risk object encapsulate Greeks. All Greeks are signed.
+    Greeks are stored in a single numpy vector ordered (delta, gamma, theta, vega, rho),
+    so aggregating risks is one vector add instead of five scalar adds.
     """
-    def __init__(self, delta=0, gamma=0, theta=0, vega=0, rho=0):
-        self.delta = delta
-        self.gamma = gamma
-        self.theta = theta
-        self.vega = vega
-        self.rho = rho
+    def __init__(self, delta=0, gamma=0, theta=0, vega=0, rho=0, vec=None):
+        if vec is None:
+            greeks = (delta, gamma, theta, vega, rho)
+            # np.array would silently store None as NaN, which then poisons every risk it is added to
+            if None in greeks:
+                raise TypeError(f"Risk: greeks must be numbers, got d: {delta}, g: {gamma}, t: {theta}, v: {vega}, r: {rho}")
+            vec = np.array(greeks, dtype=np.float64)
+        self.vec = vec
+
+    @property
+    def delta(self):
+        return self.vec[0]
+
+    @delta.setter
+    def delta(self, value):
+        self.vec[0] = value
+
+    @property
+    def gamma(self):
+        return self.vec[1]
+
+    @gamma.setter
+    def gamma(self, value):
+        self.vec[1] = value
+
+    @property
+    def theta(self):
+        return self.vec[2]
+
+    @theta.setter
+    def theta(self, value):
+        self.vec[2] = value
+
+    @property
+    def vega(self):
+        return self.vec[3]
+
+    @vega.setter
+    def vega(self, value):
+        self.vec[3] = value
+
+    @property
+    def rho(self):
+        return self.vec[4]
+
+    @rho.setter
+    def rho(self, value):
+        self.vec[4] = value
 
     def add(self, other):
         """
         Add another Risk object to this Risk object. Not an in-place operation.
         """
-        return Risk(
-            delta=self.delta+other.delta,
-            gamma=self.gamma+other.gamma,
-            theta=self.theta+other.theta,
-            vega=self.vega+other.vega, 
-            rho=self.rho+other.rho
-        )
+        return Risk(vec=self.vec + other.vec)
 
     def multiply(self, factor:float):
         """
         Multiply all risk measures by a factor. Not an in-place operation.
         """
-        return Risk(
-        delta=self.delta*factor,
-        gamma=self.gamma*factor,
-        theta=self.theta*factor,
-        vega=self.vega*factor,
-        rho=self.rho*factor
-        )
+        return Risk(vec=self.vec * factor)
+
+    def inplace_add_delta(self, delta: float):
+        """
+        Add to delta in place, without allocating a new Risk object.
+        """
+        self.vec[0] += delta
+
+    @staticmethod
+    def sum(risks):
+        """
+        Sum an iterable of Risk objects in one vectorized pass.
+        """
+        return Risk(vec=np.sum([risk.vec for risk in risks], axis=0))
 
     def is_within_risk_limits(self, risk_limit: RiskLimit):
         """
         Returns True if this Risk object is bounded by the given RiskLimit object.
         """
-        return self.is_within_delta_limit(risk_limit) and \
-                (risk_limit.min_gamma <= self.gamma <= risk_limit.max_gamma) and \
-                (risk_limit.min_theta <= self.theta <= risk_limit.max_theta) and \
-                (risk_limit.min_vega <= self.vega <= risk_limit.max_vega) and \
-                (risk_limit.min_rho <= self.rho <= risk_limit.max_rho)
+        vec = self.vec[risk_limit.active_index]
+        return bool(((vec >= risk_limit.active_lo) & (vec <= risk_limit.active_hi)).all())
     
     def is_within_delta_limit(self, delta_limit: RiskLimit):
         """
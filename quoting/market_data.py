@@ -156,6 +156,12 @@ class MarketData(AbstractQuotingModule):
     def get_last_update_timestamp(self):
         return self._last_md_update_timestamp
 
+    def get_stale_deadline(self) -> float:
+        """
+        unix timestamp (in seconds) at which this market data becomes stale if no further update arrives
+        """
+        return self._last_md_update_timestamp + self.market_data_stale_time_threshold
+
     def get_funding_rate(self) -> Optional[float]:
         """
         get the funding rate for the perpetual market
@@ -4,16 +4,67 @@ import threading
 import numpy as np
 from typing import Callable, Optional, Union
 from lib.common.numbers import trim_sig_figs
-from collections import deque
 
 logger = logging.getLogger(__name__)
 
+class RingBuffer:
+    """
+    Fixed-size float64 ring buffer, preallocated once. Like deque(maxlen=...), index -1 is the newest value.
+    """
+    def __init__(self, maxlen: int):
+        self.maxlen = maxlen
+        self._array = np.empty(maxlen, dtype=np.float64)
+        self._head = 0  # number of values ever appended, the next write goes to _head % maxlen
+
+    def append(self, value: float) -> None:
+        self._array[self._head % self.maxlen] = value
+        self._head += 1
+
+    @property
+    def total_appended(self) -> int:
+        """
+        number of values ever appended, moves on with every new sample even once the buffer is full
+        """
+        return self._head
+
+    def __len__(self) -> int:
+        return min(self._head, self.maxlen)
+
+    def __getitem__(self, index: int) -> float:
+        length = len(self)
+        if not -length <= index < length:
+            raise IndexError("RingBuffer index out of range")
+        if index < 0:
+            index += length
+        return self._array[(self._head - length + index) % self.maxlen]
+
+    def recent(self, n: int) -> np.ndarray:
+        """
+        the newest n values, oldest first. A view into the buffer when they are contiguous, a copy otherwise
+        """
+        n = min(n, len(self))
+        end = self._head % self.maxlen
+        if end == 0:
+            end = self.maxlen if self._head else 0
+        if n <= end:
+            return self._array[end - n:end]
+        return np.concatenate((self._array[self.maxlen - (n - end):], self._array[:end]))
+
+    def to_array(self) -> np.ndarray:
+        """
+        copy of buffered values, oldest first
+        """
+        if self._head <= self.maxlen:
+            return self._array[:self._head].copy()
+        start = self._head % self.maxlen
+        return np.concatenate((self._array[start:], self._array[:start]))
+
 class MetricCollector:
     def __init__(self, name: str, metric_polling_function: Callable[[], Optional[Union[int, float]]], polling_interval=1, max_length=600):
         self.name = name
         self.metric_polling_function = metric_polling_function
         self.polling_interval = polling_interval  
-        self.data = deque(maxlen=max_length)
+        self.data = RingBuffer(maxlen=max_length)
         self.last_log_timestamp = 0
         self.start()
 
@@ -38,4 +89,4 @@ class MetricCollector:
             time.sleep(self.polling_interval)
 
     def get_data(self):
-        return np.array(self.data)
+        return self.data.to_array()
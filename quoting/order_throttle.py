@@ -51,11 +51,12 @@ class OrderThrottle(AbstractQuotingModule):
         now = time.time()       
         # time throttle first, do nothing if under time throttle
         if (now - self._last_time_we_sent_quotes.get(trading_account_id, 0)) < self._time_throttle:
-            logger.info(f"Order Throttle: Time since last action under throttle, snoozing.")
+            logger.info("Order Throttle: Time since last action under throttle, snoozing.")
             return filtered_quotes, order_ids_to_cancel
         # if no open orders, place new orders without throttling
         if not oid_to_open_order.keys():
-            logger.info(f"Order Throttle: No open orders on account: {trading_account_id}, sending quotes {[str(q) for q in raw_quotes]}")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Order Throttle: No open orders on account: %s, sending quotes %s", trading_account_id, [str(q) for q in raw_quotes])
             return raw_quotes, order_ids_to_cancel
         # then throttle by price and size
         for intended_quote in raw_quotes:
@@ -75,15 +76,15 @@ class OrderThrottle(AbstractQuotingModule):
                     if has_mid_price_moved:
                         filtered_quotes.append(intended_quote)
                         order_ids_to_cancel.add(order_id)
-                        logger.info(f"Order Throttle: mid price moved, replacing {open_order} with {intended_quote}")
+                        logger.info("Order Throttle: mid price moved, replacing %s with %s", open_order, intended_quote)
                         break
                     elif is_new_quote_more_conservative:
                         filtered_quotes.append(intended_quote)
                         order_ids_to_cancel.add(order_id)
-                        logger.info(f"Order Throttle: more conservative order, replacing {open_order} with {intended_quote}")
+                        logger.info("Order Throttle: more conservative order, replacing %s with %s", open_order, intended_quote)
                         break
                     else:
-                        logger.info(f"Order Throttle: {intended_quote} is similar to open order {open_order}, ignoring")
+                        logger.info("Order Throttle: %s is similar to open order %s, ignoring", intended_quote, open_order)
                         break
                     # if new quote is different from live order, we cancel existing, and send new
             if not is_live:
@@ -91,5 +92,6 @@ class OrderThrottle(AbstractQuotingModule):
 
         if filtered_quotes:
             self._last_time_we_sent_quotes.update({trading_account_id: now})
-            logger.info(f"Order Throttle: new quotes: {[str(q) for q in filtered_quotes]}, open orders to cancel: {order_ids_to_cancel}")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Order Throttle: new quotes: %s, open orders to cancel: %s", [str(q) for q in filtered_quotes], order_ids_to_cancel)
         return filtered_quotes, order_ids_to_cancel
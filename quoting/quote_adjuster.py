@@ -5,10 +5,9 @@ based on config, market conditions, and risk limits.
 Yuanming Tang, 2023
 """
 
-import logging, random
+import logging
 import numpy as np
 from typing import Dict, List, Optional, Tuple
-from lib.common.numbers import round_number_to_precision
 from lib.quoting.vwap import VWAP
 from app.mm.config import TradingConfig
 from lib.quoting.trade_vwap import TradeVWAP
@@ -16,10 +15,87 @@ from lib.quoting.market_data import MarketData
 from lib.quoting.risk_manager import RiskManager
 from lib.quoting.metric_collector import MetricCollector
 from lib.quoting.abstract_quoting_module import AbstractQuotingModule
-from lib.common.types.order import Quote, OrderSide, round_price_to_precision, is_price_more_aggressive
+from lib.common.jit import njit
+from lib.common.types.order import Quote, OrderSide
 
 logger = logging.getLogger(__name__)
 
+# bits of the per-quote adjustment flags returned by _adjust_quotes
+TRADE_VWAP_BACKOFF = 1
+MARKET_VWAP_BACKOFF = 2
+WIDEN = 4
+JOIN_BBO = 8
+ADJUSTMENT_NAMES = ((TRADE_VWAP_BACKOFF, "trade vwap backoff"), (MARKET_VWAP_BACKOFF, "market vwap backoff"), (WIDEN, "widen"), (JOIN_BBO, "join bbo"))
+
+@njit(cache=True)
+def _adjust_quotes(
+    prices: np.ndarray,
+    quantities: np.ndarray,
+    sides: np.ndarray,
+    widths: np.ndarray,
+    mids: np.ndarray,
+    trade_vwap_buy: float,
+    trade_vwap_sell: float,
+    market_vwap: float,
+    best_bid: float,
+    best_ask: float,
+    widen: bool,
+    improve_bbo: bool,
+    fee_rate: float,
+    quote_asset_precision: float,
+    inverse_quote_asset_precision: float,
+    base_asset_precision: float,
+    inverse_base_asset_precision: float,
+    quantity_multipliers: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    numeric body of QuoteAdjuster.on_order_book_tick, one vectorized pass per adjustment that is actually needed.
+    sides is +1 for asks and -1 for bids, i.e. the direction that moves a quote away from mid.
+    missing reference prices are passed as NaN, comparisons against NaN are False so those adjustments are skipped,
+    which is also why this kernel must not be compiled with fastmath.
+    returns adjusted prices, adjusted quantities and a bitmask of the adjustments applied to each quote.
+    """
+    is_bid = sides < 0
+    flags = np.zeros(prices.shape[0], dtype=np.int64)
+    # each adjustment below first builds the mask of quotes it applies to, and only rewrites prices if that mask is not empty
+    # back off bids more aggressive than historical sell vwap, and asks more aggressive than historical buy vwap
+    if not (np.isnan(trade_vwap_buy) and np.isnan(trade_vwap_sell)):
+        break_even_prices = np.full(prices.shape[0], trade_vwap_buy)
+        break_even_prices[is_bid] = trade_vwap_sell
+        is_too_aggro = sides * (prices - break_even_prices) < 0
+        if is_too_aggro.any():
+            prices = np.where(is_too_aggro, break_even_prices * (1 + widths * sides), prices)
+            flags = flags + is_too_aggro * TRADE_VWAP_BACKOFF
+    # back off quotes more aggressive than market vwap
+    if not np.isnan(market_vwap):
+        is_too_aggro = sides * (prices - market_vwap) < 0
+        if is_too_aggro.any():
+            prices = np.where(is_too_aggro, market_vwap * (1 + widths * sides), prices)
+            flags = flags + is_too_aggro * MARKET_VWAP_BACKOFF
+    if widen:
+        # TODO: right now we just double quote width if market is volatile, make this configurable
+        prices = prices + mids * widths * sides
+        flags = flags + WIDEN
+    if not improve_bbo:
+        is_through_bbo = (is_bid & (prices > best_bid)) | (~is_bid & (prices < best_ask))
+        if is_through_bbo.any():
+            # fmin / fmax ignore a missing (NaN) side of the book instead of propagating it
+            prices = np.where(is_bid, np.fmin(prices, best_bid), np.fmax(prices, best_ask))
+            flags = flags + is_through_bbo * JOIN_BBO
+    # quantity_multipliers is empty when sizes are not randomized
+    if quantity_multipliers.shape[0] > 0:
+        quantities = quantities * quantity_multipliers
+    # apply trading fee to quote price
+    prices = prices + prices * fee_rate * sides
+    # round quote price and quantity to market-specific precision, always rounding price to less aggressive (bid prices down and ask prices up)
+    # -sides * floor(-sides * x) is floor(x) for bids and ceil(x) for asks
+    if inverse_quote_asset_precision:
+        prices = -sides * np.floor(-sides * prices * inverse_quote_asset_precision) * quote_asset_precision
+    if inverse_base_asset_precision:
+        quantities = np.round(quantities * inverse_base_asset_precision) * base_asset_precision
+    return prices, quantities, flags
+
+
 class QuoteAdjuster(AbstractQuotingModule):
     """
     Quote Adjuster make exchange-market specific changes to the orders
@@ -44,6 +120,11 @@ class QuoteAdjuster(AbstractQuotingModule):
         self.market_vwap: Optional[VWAP] = market_vwap          # 30 minutes VWAP data, by default
         self.trade_vwap: Optional[TradeVWAP] = trade_vwap        # 30 minutes VWAP data, by default
         self._exchange_instr_to_market_data: Dict[Tuple[str, str], MarketData] = exchange_instr_to_market_data
+        # (exchange_id, instrument_id) -> (1 / quote_asset_precision, 1 / base_asset_precision), 0.0 if precision is not set
+        self._exchange_instr_to_inverse_precisions: Dict[Tuple[str, str], Tuple[float, float]] = {}
+        # vwaps are pushed by VWAP / TradeVWAP when they change, so the tick path only reads these
+        self._cached_market_vwap: Optional[float] = None
+        self._cached_trade_vwaps: Tuple[Optional[float], Optional[float]] = (None, None)
         self._improve_bbo: None
         self._randomize_size: None
         self.startup()
@@ -57,10 +138,35 @@ class QuoteAdjuster(AbstractQuotingModule):
         # TODO: make this configurable, right now hard-coded to 95% of our tightest spread as specified in config file
         self._quote_widening_threshold_market_spread: float = 0.95 * (2 * min(self.config.quoting_kpis.keys()))
         logger.info(f"Quote Adjuster quote_widening_threshold_market_spread set to {self._quote_widening_threshold_market_spread}")
+        if self.market_vwap is not None:
+            self.market_vwap.subscribe(self._on_market_vwap_update)
+        if self.trade_vwap is not None:
+            self.trade_vwap.subscribe(self._on_trade_vwap_update)
 
     def shutdown(self):
         pass
 
+    def _on_market_vwap_update(self, market_vwap: Optional[float]) -> None:
+        self._cached_market_vwap = market_vwap
+
+    def _on_trade_vwap_update(self, trade_vwaps: Tuple[Optional[float], Optional[float]]) -> None:
+        self._cached_trade_vwaps = trade_vwaps
+
+    def _get_inverse_precisions(self, exchange_id: str, instrument_id: str, md: MarketData) -> Tuple[float, float]:
+        """
+        market precisions are fixed once MarketData is created, so we only compute their inverses once per market
+        """
+        inverse_precisions = self._exchange_instr_to_inverse_precisions.get((exchange_id, instrument_id))
+        if inverse_precisions is None:
+            quote_asset_precision = md.get_quote_asset_precision()
+            base_asset_precision = md.get_base_asset_precision()
+            inverse_precisions = (
+                1.0 / quote_asset_precision if quote_asset_precision else 0.0,
+                1.0 / base_asset_precision if base_asset_precision else 0.0,
+            )
+            self._exchange_instr_to_inverse_precisions[(exchange_id, instrument_id)] = inverse_precisions
+        return inverse_precisions
+
     def compute_historical_volatility(self):
         prices = self._price_tracker.get_data()
         annualized_volatility_scaling_factor = (60 * 60 * 24 * 365.25) / self._price_tracker.polling_interval
@@ -81,50 +187,63 @@ class QuoteAdjuster(AbstractQuotingModule):
         market_best_ask: float = md.get_best_ask()
         base_asset_precision: float = md.get_base_asset_precision()
         quote_asset_precision: float = md.get_quote_asset_precision()
+        inverse_quote_asset_precision, inverse_base_asset_precision = self._get_inverse_precisions(exchange_id, instrument_id, md)
         price_volatility = self.compute_historical_volatility()
         max_market_spread = self.compute_max_spread()
-        market_vwap = self.market_vwap.get_vwap() if self.market_vwap is not None else None
-        trade_vwap_buy, trade_vwap_sell = self.trade_vwap.get_historical_buy_and_sell_vwaps() if self.trade_vwap is not None else (None, None)
+        market_vwap_source = self.market_vwap
+        if market_vwap_source is not None and market_vwap_source.get_time_nanos() >= market_vwap_source.next_expiry_ns:
+            # quiet tape, expire old trades here; the refreshed vwap comes back through _on_market_vwap_update
+            market_vwap_source.get_vwap()
+        market_vwap = self._cached_market_vwap
+        if self.trade_vwap is not None and self.trade_vwap.needs_schedule:
+            # a TradeVWAP built off the trading loop starts polling from its first tick, its vwaps are pushed from then on
+            self.trade_vwap.on_order_book_tick()
+        trade_vwap_buy, trade_vwap_sell = self._cached_trade_vwaps
         is_spread_large = max_market_spread > self._quote_widening_threshold_market_spread
         is_market_volatile = price_volatility > self._quote_widening_threshold_volatility
         if is_market_volatile:
-            logger.info(f"Quote Adjuster: 30 mins historical volatility: {price_volatility} > {self._quote_widening_threshold_volatility} threshold, widening quotes")
+            logger.info("Quote Adjuster: 30 mins historical volatility: %s > %s threshold, widening quotes", price_volatility, self._quote_widening_threshold_volatility)
         if is_spread_large:
-            logger.info(f"Quote Adjuster: 15 min max spread: {max_market_spread:.6f} > {self._quote_widening_threshold_market_spread} threshold, widening quotes")
-        adjusted_quotes = []
-        for quote in intended_quotes:
-            new_quote: Quote = Quote(quote.side, quote.price, quote.quantity, quote.context)
-            if (trade_vwap_sell is not None and new_quote.side == OrderSide.BUY and is_price_more_aggressive(new_quote.price, trade_vwap_sell, new_quote.side)) or \
-                (trade_vwap_buy is not None and new_quote.side == OrderSide.SELL and is_price_more_aggressive(new_quote.price, trade_vwap_buy, new_quote.side)):
-                break_even_price = trade_vwap_sell if new_quote.side == OrderSide.BUY else trade_vwap_buy
-                new_quote.price = break_even_price * (1 + new_quote.context.quote_width * (-1 if new_quote.side == OrderSide.BUY else 1))
-                logger.info(f"Quote Adjuster: {exchange_id} {instrument_id} {new_quote.side.value} quote price {quote.price} too aggro vs historical {'sell' if new_quote.side == OrderSide.BUY else 'buy'} vwap {trade_vwap_sell if new_quote.side == OrderSide.BUY else trade_vwap_buy}, backing off to {new_quote.price}")
-            if market_vwap is not None and is_price_more_aggressive(new_quote.price, market_vwap, quote.side):
-                new_quote.price = market_vwap * (1 + new_quote.context.quote_width * (-1 if new_quote.side == OrderSide.BUY else 1))
-                logger.info(f"Quote Adjuster: {exchange_id} {instrument_id} {new_quote.side.value} quote price {quote.price} too aggro vs market vwap {market_vwap}, backing off to {new_quote.price}")
-            if is_market_volatile or is_spread_large:
-                # TODO: right now we just double quote width if market is volatile, make this configurable
-                # TODO: this only needs to be done once on generic quotes, no need to iterate over each exchange (speed optimization)
-                price_change = new_quote.context.market_mid * new_quote.context.quote_width * (-1 if new_quote.side == OrderSide.BUY else 1)
-                new_quote.price += price_change
-                logger.info(f"Quote Adjuster: widening {exchange_id} {instrument_id} {new_quote.side.value} quote price from {quote.price} to {new_quote.price}")
-            if not self._improve_bbo:
-                if new_quote.side == OrderSide.BUY and new_quote.price > market_best_bid:
-                    new_quote.price = market_best_bid
-                    logger.info(f"Quote Adjuster: {exchange_id} {instrument_id} {new_quote.side.value} quote price {quote.price} too aggro, joining best bid @ {new_quote.price} instead")
-                elif new_quote.side == OrderSide.SELL and new_quote.price < market_best_ask:
-                    new_quote.price = market_best_ask
-                    logger.info(f"Quote Adjuster: {exchange_id} {instrument_id} {new_quote.side.value} quote price {quote.price} too aggro, joining best ask @ {new_quote.price} instead")
-            if self._randomize_size:
-                new_quote.quantity *= random.uniform(0.95, 1.00)
-            # apply trading fee to quote price
-            trading_fee_rate = self._risk_manager.get_maker_fee_by_account_id(self._risk_manager.exchange_id_to_account_id.get(exchange_id))
-            trading_fee = new_quote.price * max(trading_fee_rate, 0.0) * (-1 if new_quote.side == OrderSide.BUY else 1)
-            new_quote.price += trading_fee
-            # round quote price and quantity to market-specific precision, always rounding price to less aggressive (bid prices down and ask prices up)
-            rounded_price = round_price_to_precision(side=new_quote.side, price=new_quote.price, precision=quote_asset_precision)
-            rounded_quantity = round_number_to_precision(number=new_quote.quantity, precision=base_asset_precision)
-            new_quote.price = rounded_price
-            new_quote.quantity = rounded_quantity
-            adjusted_quotes.append(new_quote)
-        return adjusted_quotes
+            logger.info("Quote Adjuster: 15 min max spread: %.6f > %s threshold, widening quotes", max_market_spread, self._quote_widening_threshold_market_spread)
+        if not intended_quotes:
+            return []
+        # stack quotes into arrays for the numeric kernel, missing reference prices are passed as NaN
+        prices = np.array([quote.price for quote in intended_quotes], dtype=np.float64)
+        quantities = np.array([quote.quantity for quote in intended_quotes], dtype=np.float64)
+        sides = np.array([1.0 if quote.side == OrderSide.SELL else -1.0 for quote in intended_quotes])
+        widths = np.array([quote.context.quote_width for quote in intended_quotes], dtype=np.float64)
+        mids = np.array([quote.context.market_mid for quote in intended_quotes], dtype=np.float64)
+        quantity_multipliers = np.random.uniform(0.95, 1.00, size=len(intended_quotes)) if self._randomize_size else np.empty(0)
+        trading_fee_rate = self._risk_manager.get_maker_fee_by_account_id(self._risk_manager.exchange_id_to_account_id.get(exchange_id))
+        adjusted_prices, adjusted_quantities, flags = _adjust_quotes(
+            prices,
+            quantities,
+            sides,
+            widths,
+            mids,
+            np.nan if trade_vwap_buy is None else trade_vwap_buy,
+            np.nan if trade_vwap_sell is None else trade_vwap_sell,
+            np.nan if market_vwap is None else market_vwap,
+            np.nan if market_best_bid is None else market_best_bid,
+            np.nan if market_best_ask is None else market_best_ask,
+            is_market_volatile or is_spread_large,
+            bool(self._improve_bbo),
+            max(trading_fee_rate, 0.0),
+            quote_asset_precision or 0.0,
+            inverse_quote_asset_precision,
+            base_asset_precision or 0.0,
+            inverse_base_asset_precision,
+            quantity_multipliers,
+        )
+        if logger.isEnabledFor(logging.INFO):
+            for i in np.flatnonzero(flags):
+                logger.info(
+                    "Quote Adjuster: %s %s %s quote price %s adjusted to %s (%s), trade vwap buy: %s, trade vwap sell: %s, market vwap: %s, best bid: %s, best ask: %s",
+                    exchange_id, instrument_id, intended_quotes[i].side.value, prices[i], adjusted_prices[i],
+                    ", ".join(name for bit, name in ADJUSTMENT_NAMES if flags[i] & bit),
+                    trade_vwap_buy, trade_vwap_sell, market_vwap, market_best_bid, market_best_ask,
+                )
+        return [
+            Quote(quote.side, price, quantity, quote.context)
+            for quote, price, quantity in zip(intended_quotes, adjusted_prices.tolist(), adjusted_quantities.tolist())
+        ]
@@ -1,8 +1,7 @@
+import math
+import time
 import logging
-from typing import Dict, Optional, Tuple
-
 from ast import literal_eval
-from typing import Dict, Optional, Set, Tuple
 from numpy import sign
 from typing import Dict, Optional, Set, Tuple
 from lib.quoting.abstract_quoting_module import AbstractQuotingModule
@@ -10,7 +9,6 @@ from lib.datadog.datadog_service import DatadogService
 from app.mm.trading_switch_manager import TradingSwitch
 from lib.quoting.market_data import MarketData
 from app.mm.config import MarketMakerAppConfig
-from lib.datadog.datadog_service import DatadogService
 
 logger = logging.getLogger(__name__)
 
@@ -36,15 +34,20 @@ class ReferencePrice(AbstractQuotingModule):
         self._md_id_to_last_update_timestamp: Dict[str, int] = {}
         self._best_bid: Optional[float] = None
         self._best_ask: Optional[float] = None
+        # staleness cache, refreshed on every reference market tick instead of on every get_bid_and_ask call
+        self._any_stale: bool = True
+        self._stale_deadline: float = -math.inf
         self.startup()
         
     def startup(self):
         for raw_mdid, multiplier in self.config.trading.reference_market_to_multiplier.items():
-            mdid = literal_eval(raw_mdid)   # convert string "('binance', 'BTC/USDT')" to tuple ('binance', 'BTC/USDT')
+            # config may already provide tuple keys, otherwise convert string "('binance', 'BTC/USDT')" to tuple ('binance', 'BTC/USDT')
+            mdid = raw_mdid if isinstance(raw_mdid, tuple) else literal_eval(raw_mdid)
             self._md_id_to_multiplier.update({mdid: multiplier})
             self._md_id_to_last_update_timestamp.update({mdid: 0})
             self._md_id_to_md.update({mdid: None})
             logger.info(f"ReferencePrice: will listen to {mdid[0]}-{mdid[1]} with multiplier {multiplier} to update reference price")
+        self._update_stale_flag()
         logger.info("ReferencePrice is initialized")
         return
     
@@ -57,23 +60,24 @@ class ReferencePrice(AbstractQuotingModule):
         and that multiplier is used to compute the reference price
         1 means multiply, -1 means divide
         """
-        if mdid not in self.get_reference_market_ids():
+        if mdid not in self._md_id_to_md:
             # logger.info(f"ReferencePrice: {mdid} is not in the reference market list, ignored")
             return
         elif self._md_id_to_md.get(mdid) is None:
             self._md_id_to_md.update({mdid: md})
-            logger.info(f"ReferencePrice: {mdid} assigned to {md.name}: current best bid: {md.get_best_bid()}, current best ask: {md.get_best_ask()}")
+            logger.info("ReferencePrice: %s assigned to %s: current best bid: %s, current best ask: %s", mdid, md.name, md.get_best_bid(), md.get_best_ask())
+        self._update_stale_flag()
         bid, ask = 1, 1
         for mdid, multiplier in self._md_id_to_multiplier.items():
             multiplier_sign, multiplier_value = sign(multiplier), abs(multiplier)
             if self._md_id_to_md.get(mdid) is None:
-                logger.info(f"ReferencePrice: MarketData with id: {mdid} is not ready, skip")
+                logger.info("ReferencePrice: MarketData with id: %s is not ready, skip", mdid)
                 return
             if mdid in self._md_id_to_md.keys():
                 md_best_bid = self._md_id_to_md.get(mdid).get_best_bid()
                 md_best_ask = self._md_id_to_md.get(mdid).get_best_ask()
                 if md_best_bid is None or md_best_ask is None:
-                    logger.info(f"ReferencePrice: {mdid} has no best bid or best ask, skip")
+                    logger.info("ReferencePrice: %s has no best bid or best ask, skip", mdid)
                     return
                 elif multiplier_sign == 1:
                     bid *= md_best_bid * multiplier_value
@@ -83,7 +87,7 @@ class ReferencePrice(AbstractQuotingModule):
                     ask /= md_best_ask * multiplier_value
         self._best_bid = bid
         self._best_ask = ask
-        logger.info(f"ReferencePrice: {mdid} updated, new reference price: bid: {self._best_bid}, ask: {self._best_ask}")
+        logger.info("ReferencePrice: %s updated, new reference price: bid: %s, ask: %s", mdid, self._best_bid, self._best_ask)
         return
 
     def get_reference_market_ids(self) -> Set[Tuple[str, str]]:
@@ -94,7 +98,7 @@ class ReferencePrice(AbstractQuotingModule):
         compute mid market price from scaled orderbook
         """
         if self._best_bid is None or self._best_ask is None:
-            logging.info(f"ReferencePrice: unable to calculate mid price: best bid: {self._best_bid}, best ask: {self._best_ask}")
+            logger.info("ReferencePrice: unable to calculate mid price: best bid: %s, best ask: %s", self._best_bid, self._best_ask)
             return None
         
         return (self._best_bid + self._best_ask) / 2
@@ -105,7 +109,18 @@ class ReferencePrice(AbstractQuotingModule):
         return self._best_bid, self._best_ask
     
     def is_market_data_stale(self) -> bool:
+        return self._any_stale or time.time() >= self._stale_deadline
+
+    def _update_stale_flag(self) -> None:
+        """
+        reference price is stale if any reference market is unassigned or has no data yet,
+        otherwise it goes stale at the earliest time any of the reference markets goes stale
+        """
+        stale_deadline = math.inf
         for md in self._md_id_to_md.values():
-            if md is None or md.is_market_data_stale():
-                return True
-        return False
\ No newline at end of file
+            if md is None or md.get_last_update_timestamp() == 0:
+                self._any_stale = True
+                return
+            stale_deadline = min(stale_deadline, md.get_stale_deadline())
+        self._stale_deadline = stale_deadline
+        self._any_stale = False
\ No newline at end of file
@@ -1,3 +1,4 @@
+import sys
 import time
 import logging
 import numpy as np
@@ -17,6 +18,15 @@ from lib.quoting.metric_collector import MetricCollector
 
 
 
+# trading switch issues raised by the risk manager
+_ISSUE_LARGE_POS = sys.intern('large position change')
+_ISSUE_MAX_LOSS = sys.intern('max_loss_reached')
+_ISSUE_RISK_EXCEED = sys.intern('risk_limit_exceeded')
+
+# pricing inputs for option greeks
+OPTION_PRICING_VOLATILITY = 0.5
+OPTION_PRICING_INTEREST_RATE = 0.05
+
 class RiskManagerUpdateType(Enum):
     PRICE = "price"
     POSITION = "position"
@@ -55,18 +65,27 @@ class RiskManager(AbstractQuotingModule):
         self._option_list: List[Option] = None
         self._option_risks: Risk = Risk()
         self._twap_delta: Risk = None
+        # total risks are recomputed at most once per tick, and again only after a position, TWAP or option update
+        self._cached_total_risks: Optional[Risk] = None
+        self._risks_dirty: bool = True
+        # set by anything that can change risks, cleared only once the risk checks have run on them
+        self._risk_checks_pending: bool = True
         self._pnl_cache: List[Tuple[float, float]] = []
         self._pnl_so_far = 0
         self.last_total_delta_risk = None
-        self.last_delta_risk_update_timestamp = 0
+        # elapsed-time bookkeeping uses time.monotonic(), -inf means never
+        self.last_delta_risk_update_timestamp = -np.inf
         # state from last time-type update
-        self._last_option_update_timestamp = 0
+        self._last_option_update_timestamp = -np.inf
+        self._last_option_update_price: Optional[float] = None
         self._last_best_bid = None
         self._last_best_ask = None
         # params
         self._config_reduce_only = None
         self.send_orders = None
         self._risk_limit: RiskLimit = None
+        self._min_delta: float = None
+        self._max_delta: float = None
         self._max_loss: float = None
         self._manual_skew: Risk = None
         self.startup()
@@ -87,6 +106,9 @@ class RiskManager(AbstractQuotingModule):
                 min_rho=self.config.trading.risk_limit.get("min_rho", -np.inf),
                 max_rho=self.config.trading.risk_limit.get("max_rho", np.inf)
                 )
+        # delta limits are read on every risk check
+        self._min_delta = self._risk_limit.min_delta
+        self._max_delta = self._risk_limit.max_delta
         self._max_loss: float = self.config.trading.max_loss
         self._manual_skew = Risk(
                 delta=self.config.trading.manual_skew.get("delta"),
@@ -99,18 +121,37 @@ class RiskManager(AbstractQuotingModule):
         self._config_reduce_only = self.config.trading.reduce_only
         self.dollar_quoting_size = max(dollar_size for _, dollar_size in self.config.trading.quoting_kpis.items())
         self.exchange_id_to_account_id = {account.ccxt_exchange_id: account.internal_account_id for account in self.config.exchange_accounts}
+        # alert routing does not change after startup
+        self._alert_title_prefix = f"[{self.config.project}]"
+        self._alert_tags = {"project": self.config.project}
+        self._alert_channel = self.config.slack.channels.alerts_trading
+        self._alert_channel_critical = self.config.slack.channels.alerts_critical
         
         self.large_fill_lookback_period = self.config.trading.large_fill_lookback_period    # how far to look back in time for position change
         self.large_fill_threshold_usd = self.config.trading.large_fill_threshold_usd        # what constitute a large fill
         self.large_fill_cooldown_time = self.config.trading.large_fill_cooldown_time        # how long to stop trading after a large fill
-        self.large_fill_cooldown_start_time = 0
+        self.large_fill_cooldown_start_time = -np.inf
         self.position_history: Optional[MetricCollector] = None
+        self._last_history_head: int = -1     # position_history appends seen at the last full large position change check
+        # option parameters are fixed for the session, only the underlying price changes between greek refreshes
+        self._option_list = [
+            Option(
+                self.config.trading.option.get('size'),
+                self.config.trading.option.get('underlying_asset'),
+                self.config.trading.option.get('expiry_timestamp'),
+                self.config.trading.option.get('strike'),
+                self.config.trading.option.get('type')
+            )
+        ]
+        # expiries are fixed, so the point at which the nearest one is within 24 hours is known up front (on the monotonic clock)
+        self._option_expiry_timestamp = min(option.expiry_timestamp for option in self._option_list)
+        self._option_expiry_deadline = time.monotonic() + (self._option_expiry_timestamp - 24 * 60 * 60 - time.time())
 
-        logger.warning(
-            f"Risk Manager initialized, max loss: {self._max_loss}; " + \
-            f"risk limits: {self._risk_limit}; manual skew: {self._manual_skew}" + \
-            f"reduce only: {self._config_reduce_only}; send orders: {self.send_orders}"
-        )
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning(
+                "Risk Manager initialized, max loss: %s; risk limits: %s; manual skew: %sreduce only: %s; send orders: %s",
+                self._max_loss, self._risk_limit, self._manual_skew, self._config_reduce_only, self.send_orders
+            )
                 
     def set_account_manager(self, account_manager) -> None:
         self._account_manager = account_manager
@@ -127,40 +168,65 @@ class RiskManager(AbstractQuotingModule):
         maker_fee = float(account_fee.maker)
         return maker_fee
 
-    def get_position_change_over_time(self, lookback: int):
+    def _get_recent_positions(self, lookback: int) -> np.ndarray:
         """
-        Get the change of position between now and some time (in seconds) in the past.
+        Positions recorded over the last lookback seconds, oldest first.
         """
         if self.position_history is None:
+            # MetricCollector starts its polling thread on construction
             self.position_history = MetricCollector(name='Position', metric_polling_function=self.get_spot_risk, polling_interval=1, max_length=300)
-            self.position_history.start()
             current_position = self.get_spot_risk()
             for _ in range(300):
                 self.position_history.data.append(current_position)
         if lookback > self.position_history.data.maxlen:
             lookback = self.position_history.data.maxlen
             logger.warning(f"Risk Manager: attempting to look back further than position_history has records for!")
-        return self.position_history.data[-1] - self.position_history.data[-lookback]
+        return self.position_history.data.recent(lookback)
+
+    def get_position_change_over_time(self, lookback: int):
+        """
+        Get the change of position between now and some time (in seconds) in the past.
+        """
+        positions = self._get_recent_positions(lookback)
+        return positions[-1] - positions[0]
+
+    def position_window_stats(self, lookback: int) -> Tuple[float, float, float, float]:
+        """
+        (min, max, mean, change) of position over the last lookback seconds.
+        """
+        positions = self._get_recent_positions(lookback)
+        return positions.min(), positions.max(), positions.mean(), positions[-1] - positions[0]
 
-    def should_stop_trading_on_large_position_change(self):
-        issue = 'large position change'
-        usd_position_change_over_one_minute = self.get_position_change_over_time(lookback=self.large_fill_lookback_period) * self.get_market_mid()
+    def should_stop_trading_on_large_position_change(self, now: Optional[float] = None):
+        if now is None:
+            now = time.monotonic()
+        issue = _ISSUE_LARGE_POS
+        issues = self._strategy_trading_switch.issues
+        is_in_cooldown = now - self.large_fill_cooldown_start_time < self.large_fill_cooldown_time
+        # nothing to re-evaluate if no position sample was recorded since the last check and no large position change is being handled
+        if self.position_history is not None:
+            history_head = self.position_history.data.total_appended
+            if history_head == self._last_history_head and not is_in_cooldown and issue not in issues:
+                return False
+            self._last_history_head = history_head
+        _, _, _, position_change = self.position_window_stats(lookback=self.large_fill_lookback_period)
+        usd_position_change_over_one_minute = position_change * self.get_market_mid()
         usd_large_position_change_threshold = self.large_fill_threshold_usd
         is_position_change_large = abs(usd_position_change_over_one_minute) > abs(usd_large_position_change_threshold)
-        is_in_cooldown = time.time() - self.large_fill_cooldown_start_time < self.large_fill_cooldown_time
         if is_position_change_large:
-            if not issue in self._strategy_trading_switch.issues:
+            if not issue in issues:
                 self._strategy_trading_switch.add_issue(issue=issue)
-                self.large_fill_cooldown_start_time = time.time()
+                self.large_fill_cooldown_start_time = now
                 self.raise_alert(
                     key=f"Trading disabled due to {issue}",
                     title=f"Risk Manager: trading disabled due to {issue}!",
                     text=f"Risk Manager: {issue} (${usd_position_change_over_one_minute:.2f}) over past {self.large_fill_lookback_period}s, adding issue to trading switch to disable trading for {self.large_fill_cooldown_time}s!!",
                     critical=False,
                     frequency_limit=self.large_fill_cooldown_time,
+                    now=now,
                     )
             return True
-        elif issue in self._strategy_trading_switch.issues:
+        elif issue in issues:
             if not is_in_cooldown:
                 self._strategy_trading_switch.resolve_issue(issue=issue)
                 logger.warn(f"Risk Manager: {issue} {self.large_fill_cooldown_time}s cooldown is over, issue removed from trading switch!")
@@ -170,6 +236,7 @@ class RiskManager(AbstractQuotingModule):
                     text=f"Risk Manager: {issue} {self.large_fill_cooldown_time}s cooldown is over, issue removed from trading switch!!",
                     critical=False,
                     frequency_limit=1,
+                    now=now,
                     )
                 return False
             return True
@@ -182,11 +249,13 @@ class RiskManager(AbstractQuotingModule):
         """
         last_position = self._net_spot_positions.get(self.base_ccy, None) 
         self._net_spot_positions = net_spot_positions
+        self._risks_dirty = True
+        self._risk_checks_pending = True
         if last_position is None:
             base_ccy_spot_pos_change = 0
         else:
             base_ccy_spot_pos_change = net_spot_positions.get(self.base_ccy) - last_position
-        logger.info(f"Risk Manager: net spot positions updated by AccountManager: {self._net_spot_positions}")
+        logger.info("Risk Manager: net spot positions updated by AccountManager: %s", self._net_spot_positions)
         if base_ccy_spot_pos_change:
             self.get_total_risks()
             self.on_base_currency_spot_position_update(position_change=base_ccy_spot_pos_change)
@@ -195,8 +264,10 @@ class RiskManager(AbstractQuotingModule):
         """
         Called by TWAP to increment _twap_delta by size.
         """
-        self._twap_delta = self._twap_delta.add(Risk(delta=size))
-        logger.info(f"Risk Manager: added {size} to TWAP, new TWAP delta: {self._twap_delta}")
+        self._twap_delta.inplace_add_delta(size)
+        self._risks_dirty = True
+        self._risk_checks_pending = True
+        logger.info("Risk Manager: added %s to TWAP, new TWAP delta: %s", size, self._twap_delta)
         self.on_base_currency_spot_position_update(position_change=size)
 
     def _get_net_spot_positions(self) -> float:
@@ -208,53 +279,55 @@ class RiskManager(AbstractQuotingModule):
         self._net_spot_positions = self._account_manager.get_net_spot_positions()
         return self._net_spot_positions
     
-    def _get_option_risks(self):
+    def _get_option_risks(self, now: Optional[float] = None):
         if self.get_market_mid() is None:
             logger.info("Risk Manager: no price available, skipping option risk update")
             return
-        self._option_risks = Risk()
-        option = Option(
-            self.config.trading.option.get('size'),
-            self.config.trading.option.get('underlying_asset'),
-            self.config.trading.option.get('expiry_timestamp'),
-            self.config.trading.option.get('strike'),
-            self.config.trading.option.get('type')
-            )
+        if now is None:
+            now = time.monotonic()
         # if option expiry is less than 24 hours, we throw a critical error
-        if option.expiry_timestamp - time.time() < 24 * 60 * 60:
+        if now > self._option_expiry_deadline:
             self._strategy_trading_switch.add_issue("option_expiry_less_than_24_hours")
             self.raise_alert(
                 key="option expired",
                 title="Risk Manager: Option expired!",
-                text=f"Risk Manager: option expiry {option.expiry_timestamp} is less than current time {time.time()}",
+                text=f"Risk Manager: option expiry {self._option_expiry_timestamp} is less than 24 hours from current time {time.time()}",
                 critical=True,
                 frequency_limit=900,
+                now=now,
                 )
-        self._option_list = [option]
-        for opt in self._option_list:
-            d, g, v, t, r = option.compute_greeks(price=self.get_market_mid(), sigma=0.5, interest_rate=0.05)
-            option_risk = Risk(d, g, v, t, r)
+        self._option_risks = Risk()
+        market_mid = self.get_market_mid()
+        for option in self._option_list:
+            d, g, v, t, r = option.compute_greeks(price=market_mid, sigma=OPTION_PRICING_VOLATILITY, interest_rate=OPTION_PRICING_INTEREST_RATE)
+            option_risk = Risk(delta=d, gamma=g, vega=v, theta=t, rho=r)
             self._option_risks = self._option_risks.add(option_risk)
-            logger.info(f"Risk Manager updated option info: Option: {option}, risks: {self._option_risks}")
+            logger.info("Risk Manager updated option info: Option: %s, risks: %s", option, self._option_risks)
+        self._risks_dirty = True
+        self._risk_checks_pending = True
         return self._option_risks
     
     def get_spot_risk(self):
         return self._get_net_spot_positions().get(self.base_ccy, 0)
 
     def get_total_risks(self) -> Risk:
+        if not self._risks_dirty:
+            return self._cached_total_risks
         spot_risk = Risk(delta=self.get_spot_risk())
         twap_risk = self._twap_delta
         option_risk = self._option_risks
         skew = self._manual_skew
-        total_risks = Risk().add(spot_risk).add(twap_risk).add(option_risk).add(skew)
+        total_risks = Risk.sum((spot_risk, twap_risk, option_risk, skew))
         # only log risk update if there is a delta change or every 60 seconds
-        if total_risks.delta != self.last_total_delta_risk or time.time() - self.last_delta_risk_update_timestamp > 60:
-            self.last_total_delta_risk = total_risks.delta
-            self.last_delta_risk_update_timestamp = time.time()
-            logger.info(
-                f"Risk Manager risk update. Total ({total_risks}); " + \
-                f"Spot ({spot_risk}); Option ({option_risk}); TWAP ({twap_risk}); Skew ({skew})"
-            )
+        if logger.isEnabledFor(logging.INFO):
+            now = time.monotonic()
+            if total_risks.delta != self.last_total_delta_risk or now - self.last_delta_risk_update_timestamp > 60:
+                self.last_total_delta_risk = total_risks.delta
+                self.last_delta_risk_update_timestamp = now
+                logger.info(
+                    "Risk Manager risk update. Total (%s); Spot (%s); Option (%s); TWAP (%s); Skew (%s)",
+                    total_risks, spot_risk, option_risk, twap_risk, skew
+                )
         if total_risks.gamma < 0:
             self.raise_alert(
                 key='gamma',
@@ -263,6 +336,8 @@ class RiskManager(AbstractQuotingModule):
                 critical=True,
                 frequency_limit=900,
                 )
+        self._cached_total_risks = total_risks
+        self._risks_dirty = False
         return total_risks
         
     def get_market_mid(self) -> Optional[float]:
@@ -298,22 +373,34 @@ class RiskManager(AbstractQuotingModule):
         """
         # if not self._strategy_trading_switch.get_is_enabled():
         #     return
-        now = time.time()
+        now = time.monotonic()
+        # top of book unchanged and no position / TWAP / option update since the last risk checks: they would come out the same
+        if best_bid == self._last_best_bid and best_ask == self._last_best_ask and not self._risk_checks_pending and \
+                now - self._last_option_update_timestamp < 10 * 60:
+            return
+        # spot positions are pulled from AccountManager at most once per tick
+        self._risks_dirty = True
         last_mid = self.get_market_mid()
         self._last_best_bid = best_bid
         self._last_best_ask = best_ask
         new_mid = self.get_market_mid()
-        # if price change is greater than 1%, or it's been 10 minutes since last update, refresh option risks
-        if now - self._last_option_update_timestamp >= 10 * 60 or abs(new_mid - self._last_option_update_price) / self._last_option_update_price >= 0.01:
+        # option risks can only be updated with a price, keep the last option risks until we have one
+        if new_mid is None:
+            pass
+        # if there is no previous price, price change is greater than 1%, or it's been 10 minutes since last update, refresh option risks
+        elif self._last_option_update_price is None or last_mid is None or now - self._last_option_update_timestamp >= 10 * 60 or \
+                abs(new_mid - self._last_option_update_price) / self._last_option_update_price >= 0.01:
             self._last_option_update_timestamp = now
             self._last_option_update_price = new_mid
-            self._get_option_risks()
+            self._get_option_risks(now)
         # else, use gamma to approximate gamma change
         else:
             delta_change = self._option_risks.gamma * (new_mid - last_mid)
             if delta_change != 0:
-                self._option_risks = self._option_risks.add(Risk(delta=delta_change))
-        self._run_risk_checks()
+                self._option_risks.inplace_add_delta(delta_change)
+                self._risks_dirty = True
+                self._risk_checks_pending = True
+        self._run_risk_checks(now)
         
     def on_base_currency_spot_position_update(self, position_change: float):
         if self._market_maker is None:
@@ -336,7 +423,12 @@ class RiskManager(AbstractQuotingModule):
         quote_currency_balance = self._account_manager.get_balance_by_account_id_and_currency(account_id, self.quote_ccy)
         required_quote_currency_balance = self.dollar_quoting_size
         required_base_currency_balance = required_quote_currency_balance / self.get_market_mid()
-        if self.is_sending_asks() and base_currency_balance < required_base_currency_balance:
+        # same conditions as is_sending_bids / is_sending_asks, evaluated on a single total risk computation
+        delta = self.get_total_risks().delta
+        is_reduce_only = self.is_reduce_only()
+        is_sending_bids = not (is_reduce_only and delta > 0)
+        is_sending_asks = not (is_reduce_only and delta < 0)
+        if is_sending_asks and base_currency_balance < required_base_currency_balance:
             self.raise_alert(
                 key=f"insufficient_{self.base_ccy}_balance_on_{account_id}",
                 title=f"Risk Manager: insufficient_{self.base_ccy}_balance_on_{account_id}!",
@@ -344,7 +436,7 @@ class RiskManager(AbstractQuotingModule):
                 critical=True,
                 frequency_limit=28_800,
                 )
-        elif self.is_sending_asks() and base_currency_balance < 2 * required_base_currency_balance:
+        elif is_sending_asks and base_currency_balance < 2 * required_base_currency_balance:
             self.raise_alert(
                 key=f"low_{self.base_ccy}_balance_on_{account_id}",
                 title=f"Risk Manager: low_{self.base_ccy}_balance_on_{account_id}!",
@@ -352,7 +444,7 @@ class RiskManager(AbstractQuotingModule):
                 critical=False,
                 frequency_limit=86_400,
                 )
-        if self.is_sending_bids() and quote_currency_balance < required_quote_currency_balance:
+        if is_sending_bids and quote_currency_balance < required_quote_currency_balance:
             self.raise_alert(
                 key=f"insufficient_{self.quote_ccy}_balance_on_{account_id}",
                 title=f"Risk Manager: insufficient_{self.quote_ccy}_balance_on_{account_id}!",
@@ -360,7 +452,7 @@ class RiskManager(AbstractQuotingModule):
                 critical=True,
                 frequency_limit=28_800,
                 )
-        elif self.is_sending_bids() and quote_currency_balance < 2 * required_quote_currency_balance:
+        elif is_sending_bids and quote_currency_balance < 2 * required_quote_currency_balance:
             self.raise_alert(
                 key=f"low_{self.quote_ccy}_balance_on_{account_id}",
                 title=f"Risk Manager: low_{self.quote_ccy}_balance_on_{account_id}!",
@@ -370,63 +462,69 @@ class RiskManager(AbstractQuotingModule):
                 )
         return base_currency_balance < required_base_currency_balance or quote_currency_balance < required_quote_currency_balance
     
-    def _run_risk_checks(self):
+    def _run_risk_checks(self, now: float):
+        self._risk_checks_pending = False
         # disable trading if max loss is reached
-        delta = self.get_total_risks().delta 
+        total_risks = self.get_total_risks()
+        delta = total_risks.delta
+        min_delta = self._min_delta
+        max_delta = self._max_delta
         if self._pnl_so_far < -self._max_loss:
-            self._strategy_trading_switch.add_issue("max_loss_reached")
+            self._strategy_trading_switch.add_issue(_ISSUE_MAX_LOSS)
             self.raise_alert(
                 key='pnl', 
                 title="Risk Manager diabled trading!",
                 text=f"Risk Manager disabled trading because Max PNL loss breached! Current PNL: {self._pnl_so_far} is over max loss limit: {self._max_loss}",
                 critical=True,
                 frequency_limit=900,
+                now=now,
                 )
-        elif (0.8 * self._risk_limit.max_delta < delta and delta < self._risk_limit.max_delta) or (delta < self.get_total_risks().delta and delta < 0.8 * self._risk_limit.min_delta):
+        elif (0.8 * max_delta < delta and delta < max_delta) or (min_delta < delta and delta < 0.8 * min_delta):
             self._reduce_only = True
             self.raise_alert(
                 key="risk-near-limit",
                 title="Risk Manager: reduce-only mode due to delta risk near limit!",
-                text=f"Risk Manager toggled to reduce-only mode! Current delta {delta} vs. risk limits [{self._risk_limit.min_delta}, {self._risk_limit.max_delta}]!",
+                text=f"Risk Manager toggled to reduce-only mode! Current delta {delta} vs. risk limits [{min_delta}, {max_delta}]!",
                 critical=False,
                 frequency_limit=300,
+                now=now,
                 )
         # disable trading is risk limit exceeded
-        elif not self.get_total_risks().is_within_risk_limits(self._risk_limit):
-            self._strategy_trading_switch.add_issue("risk_limit_exceeded")
+        elif not total_risks.is_within_risk_limits(self._risk_limit):
+            self._strategy_trading_switch.add_issue(_ISSUE_RISK_EXCEED)
             self.raise_alert(
                 key="risk-over-limit",
                 title="Risk Manager diabled trading!",
-                text=f"Risk Manager disabled trading because risk is over limit! Current risks: {self.get_total_risks()} is over risk limit: {self._risk_limit}",
+                text=f"Risk Manager disabled trading because risk is over limit! Current risks: {total_risks} is over risk limit: {self._risk_limit}",
                 critical=False,
                 frequency_limit=900,
+                now=now,
                 )
         # otherwise, we are good to trade normally
         else:
             # TODO: resolve correct issues based on case
-            self._strategy_trading_switch.resolve_issue("max_loss_reached")
-            self._strategy_trading_switch.resolve_issue("risk_limit_exceeded")
+            self._strategy_trading_switch.resolve_issue(_ISSUE_MAX_LOSS)
+            self._strategy_trading_switch.resolve_issue(_ISSUE_RISK_EXCEED)
             self._reduce_only = False
         return
     
     def is_reduce_only(self):
         return self._reduce_only or self._config_reduce_only
 
-    def raise_alert(self, key, title, text, critical=False, frequency_limit=300):
-        now = time.time()
-        if now - self.alert_key_to_last_alert_timestamp.get(key, 0) <= frequency_limit:
+    def raise_alert(self, key, title, text, critical=False, frequency_limit=300, now: Optional[float] = None):
+        if now is None:
+            now = time.monotonic()
+        last_alert_timestamps = self.alert_key_to_last_alert_timestamp
+        if now - last_alert_timestamps.get(key, -np.inf) <= frequency_limit:
             return
-        self.alert_key_to_last_alert_timestamp.update({key: now})
+        last_alert_timestamps[key] = now
         logger.warning(text)
-        channel = self.config.slack.channels.alerts_trading
-        if critical:
-            channel = self.config.slack.channels.alerts_critical
         self.datadog_service.enqueue_event(
-            title=f"[{self.config.project}]{title}",
+            title=self._alert_title_prefix + title,
             text=text,
-            slack_channel=channel,
+            slack_channel=self._alert_channel_critical if critical else self._alert_channel,
             alert_type=DatadogAlertType.WARNING,
-            tags={"project": self.config.project},
+            tags=self._alert_tags,
         )
     
     def shutdown(self):
@@ -27,7 +27,7 @@ class TakerHedger(AbstractQuotingModule):
         self.datadog_service = datadog_service
         self._strategy_trading_switch = strategy_trading_switch
         
-        self._get_position_function = Optional[Callable[[], None]] = None
+        self._get_position_function: Optional[Callable[[], None]] = None
         
         self.taker_max_cross = None
         self.taker_max_levels = None
@@ -37,14 +37,14 @@ class TakerHedger(AbstractQuotingModule):
 
                 
     def startup(self):
-        if self.config.trading.taker_hedger is not None:
+        taker_hedger_config = self.config.trading.taker_hedger
+        if taker_hedger_config is not None:
             logger.info("TakerHedger is enabled")
-            self.taker_max_cross = self.config.trading.taker_hedger.max_cross
-            self.taker_max_levels = self.config.trading.taker_hedger.max_levels
-            self.taker_min_order_dollar_size = self.config.trading.taker_hedger.min_order_dollar_size
-            self.taker_max_order_dollar_size = self.config.trading.taker_hedger.max_order_dollar_size
-            self.taker_order_interval = 
-            
+            self.taker_max_cross = taker_hedger_config.max_cross
+            self.taker_max_levels = taker_hedger_config.max_levels
+            self.taker_min_order_dollar_size = taker_hedger_config.min_order_dollar_size
+            self.taker_max_order_dollar_size = taker_hedger_config.max_order_dollar_size
+            self.taker_order_interval = taker_hedger_config.order_interval
         else:
             logger.info("TakerHedger is disabled")
             return
@@ -7,8 +7,7 @@ Yuanming Tang, 2024
 import asyncio
 import asyncpg
 import logging
-import threading
-from typing import List, Dict, Tuple
+from typing import Callable, List, Dict, Optional, Tuple
 from lib.common.types.order import OrderSide
 from app.mm.config import MarketMakerAppConfig
 from lib.quoting.risk_manager import RiskManager
@@ -22,6 +21,12 @@ class TradeVWAP(AbstractQuotingModule):
         self.config: MarketMakerAppConfig = config
         self._instrument_id: str = self.config.trading.instrument_id
         self._account_ids: List[str] = [account.internal_account_id for account in self.config.exchange_accounts]
+        # last published (buy vwap, sell vwap), pushed to subscribers whenever it changes
+        self.latest: Tuple[Optional[float], Optional[float]] = (None, None)
+        self._subscribers: List[Callable[[Tuple[Optional[float], Optional[float]]], None]] = []
+        self.has_started: bool = False
+        self._is_running: bool = False
+        self._run_task: Optional[asyncio.Task] = None
         if self.config.trading.trade_vwap is None or not self.config.trading.trade_vwap.use_trade_vwap:
             logger.warning("TradeVWAP not configured/disabled, not initialized")
             return
@@ -29,7 +34,6 @@ class TradeVWAP(AbstractQuotingModule):
         self._vwap_query_frequency: float = self.config.trading.trade_vwap.query_frequency
         self.trade_repository = TradeRepository(db_pool)
         self.risk_manager = risk_manager
-        self.has_started: bool = False
         self.buy_vwap: float = None
         self.sell_vwap: float = None
         self.startup()
@@ -38,27 +42,70 @@ class TradeVWAP(AbstractQuotingModule):
         
     def startup(self):
         self.has_started = True
-        thread = threading.Thread(target=self.on_order_book_tick)
-        thread.name = "TradeVWAP"
-        thread.daemon = True
-        thread.start()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("TradeVWAP: no running event loop, polling starts on schedule(loop) or the first order book tick")
+            return
+        self.schedule(loop)
+
+    def schedule(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        start polling the trade VWAPs on the given event loop, the one db_pool was created on
+        """
+        if not self.needs_schedule:
+            return
+        self._run_task = loop.create_task(self.run())
+
+    @property
+    def needs_schedule(self) -> bool:
+        return self.has_started and self._run_task is None
         
     def on_order_book_tick(self) -> Tuple[float, float]:
+        # VWAPs are refreshed by run(), ticks only read the cached values. Ticks run on the trading loop though,
+        # so polling for a TradeVWAP built before that loop was running starts here
+        if self.needs_schedule:
+            try:
+                self.schedule(asyncio.get_running_loop())
+            except RuntimeError:
+                pass
         return self.get_historical_buy_and_sell_vwaps()
         
     async def run(self):
-        if not self.has_started:
+        if not self.has_started or self._is_running:
             return
-        while True:
-            logger.info(f"TradeVWAP: querying VWAP with params: {self._instrument_id}, {self._account_ids}, {self._vwap_lookback_days}")
-            vwap_dict = await self.trade_repository.get_vwap_over_period(self._instrument_id, self._account_ids, self._vwap_lookback_days)
-            self.buy_vwap = vwap_dict.get('buy')
-            self.sell_vwap = vwap_dict.get('sell')
-            logger.info(f"TradeVWAP: buy vwap {self.buy_vwap}, sell vwap {self.sell_vwap}")
-            await asyncio.sleep(self._vwap_query_frequency)
+        self._is_running = True
+        try:
+            while True:
+                logger.info("TradeVWAP: querying VWAP with params: %s, %s, %s", self._instrument_id, self._account_ids, self._vwap_lookback_days)
+                vwap_dict = await self.trade_repository.get_vwap_over_period(self._instrument_id, self._account_ids, self._vwap_lookback_days)
+                self.buy_vwap = vwap_dict.get('buy')
+                self.sell_vwap = vwap_dict.get('sell')
+                logger.info("TradeVWAP: buy vwap %s, sell vwap %s", self.buy_vwap, self.sell_vwap)
+                self._publish()
+                await asyncio.sleep(self._vwap_query_frequency)
+        finally:
+            self._is_running = False
             
     def get_historical_buy_and_sell_vwaps(self) -> Tuple[float, float]:
         return self.buy_vwap, self.sell_vwap
 
+    def subscribe(self, callback: Callable[[Tuple[Optional[float], Optional[float]]], None]) -> None:
+        """
+        register a callback invoked with new (buy vwap, sell vwap) every time they change, and once with the current values
+        """
+        self._subscribers.append(callback)
+        callback(self.latest)
+
+    def _publish(self) -> None:
+        vwaps = (self.buy_vwap, self.sell_vwap)
+        if vwaps != self.latest:
+            self.latest = vwaps
+            for callback in self._subscribers:
+                callback(vwaps)
+
     def shutdown(self):
-        pass
+        if self._run_task is not None:
+            self._run_task.cancel()
+            self._run_task = None
+        self.has_started = False
@@ -4,8 +4,11 @@ This module will gradually add delta risk to the portfolio via risk manager to b
 Yuanming Tang, 2023
 """
 import time
+import array
+import asyncio
 import logging
 import threading
+from typing import Optional
 from app.mm.config import TradingConfig
 from lib.quoting.risk_manager import RiskManager
 from lib.quoting.abstract_quoting_module import AbstractQuotingModule
@@ -18,9 +21,16 @@ class TWAP(AbstractQuotingModule):
         self._risk_manager = risk_manager
         self._twap_direction: str = None            # "buy" or "sell"
         self._twap_total_size: float = None         # total position to be added, unsigned
+        self._twap_remaining = array.array('d', [0.0])  # position still to be added, unsigned, single slot shared with readers
         self._twap_step_size: float = None          # how much position to increment each time, unsigned
         self._twap_frequency: float = None          # how often to add position, in seconds, unsigned
         self._twap_price_threshold: float = None    # price threshold to add position (below it we don't add)
+        self._twap_sign: float = None               # sign of the delta added to RM for each step
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._next_tick_time: float = None          # loop time of the next TWAP step
+        self._thread: Optional[threading.Thread] = None     # fallback driver when no event loop is running
+        self._stop_event = threading.Event()
         self.has_started = False
         self.startup()
 
@@ -28,9 +38,12 @@ class TWAP(AbstractQuotingModule):
         self._twap_direction: str = self.config.twap_direction
         self._twap_direction = str(self._twap_direction).lower()
         self._twap_total_size: float = float(self.config.twap_total_size)
+        self._twap_remaining[0] = self._twap_total_size
         self._twap_step_size: float = float(self.config.twap_step_size)
         self._twap_frequency: float = float(self.config.twap_frequency)
         self._twap_price_threshold: float = float(self.config.twap_price_threshold)
+        # we buy by leaning to negative position in RM, and sell by leaning to positive position
+        self._twap_sign = -1.0 if self._twap_direction == "buy" else 1.0
         if self._twap_direction not in ["buy", "sell"] or self._twap_total_size == 0:
             logger.warning("TWAP missing key parameters, not initialized")
             return
@@ -41,33 +54,73 @@ class TWAP(AbstractQuotingModule):
             logger.warning(f"TWAP initialized: direction {self._twap_direction}, size: {self._twap_total_size}" + \
                         f", step: {self._twap_step_size}, frequency: {self._twap_frequency}" + \
                         f", price threshold: {self._twap_price_threshold}" if self._twap_price_threshold else "")
-        thread = threading.Thread(target=self.on_order_book_tick)
-        thread.name = "TWAP"
-        thread.daemon = True
-        thread.start()
+        self.has_started = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # no loop to time the steps on, drive them from a thread as before
+            logger.warning("TWAP: no running event loop, stepping on a daemon thread")
+            self._thread = threading.Thread(target=self._run_thread, name="TWAP", daemon=True)
+            self._thread.start()
+            return
+        self.schedule(loop)
 
-    def on_order_book_tick(self):
-        if self._twap_total_size == 0:
+    def schedule(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        run TWAP steps on the given event loop, the first one right away and then every _twap_frequency seconds
+        """
+        if not self.has_started or self._timer is not None or self._thread is not None:
             return
-        while True:
-            mid_price = self._risk_manager.get_market_mid()
-            if mid_price is None:
-                logger.warning("TWAP update: market mid price not available")
-            elif self._twap_direction == "buy" and mid_price > self._twap_price_threshold:
-                logger.info("TWAP update: market mid price above buy ceiling, not buying")
-            elif self._twap_direction == "sell" and mid_price < self._twap_price_threshold:
-                logger.info("TWAP update: market mid price below sell floor, not selling")
-            else:
-                size = min(self._twap_total_size, self._twap_step_size)
-                self._twap_total_size -= size
-                logger.info(f"TWAP update: TWAP triggered. direction: {self._twap_direction}, size: {size}, remainder: {self._twap_total_size}")
-                if self._twap_direction == "buy":
-                    # we buy by leaning to negative position in RM
-                    self._risk_manager.update_twap_delta(-size)
-                else:
-                    # we sell by by leaning to positive position in RM
-                    self._risk_manager.update_twap_delta(size)
-            time.sleep(self._twap_frequency)
+        self._loop = loop
+        self._next_tick_time = loop.time()
+        self._timer = loop.call_soon(self._tick)
 
-    def shutdown(self):
+    def _tick(self):
+        if self._twap_remaining[0] == 0:
+            self._timer = None
+            return
+        self._step()
+        # steps are spaced on absolute loop time, so time spent in a step does not delay the next one
+        self._next_tick_time += self._twap_frequency
+        self._timer = self._loop.call_at(self._next_tick_time, self._tick)
+
+    def _run_thread(self):
+        next_step_time = time.monotonic()
+        while self._twap_remaining[0] != 0:
+            self._step()
+            next_step_time += self._twap_frequency
+            # wakes up early on shutdown
+            if self._stop_event.wait(max(0.0, next_step_time - time.monotonic())):
+                return
+
+    def _step(self):
+        remaining = self._twap_remaining
+        mid_price = self._risk_manager.get_market_mid()
+        if mid_price is None:
+            logger.warning("TWAP update: market mid price not available")
+        elif self._twap_direction == "buy" and mid_price > self._twap_price_threshold:
+            logger.info("TWAP update: market mid price above buy ceiling, not buying")
+        elif self._twap_direction == "sell" and mid_price < self._twap_price_threshold:
+            logger.info("TWAP update: market mid price below sell floor, not selling")
+        else:
+            size = min(remaining[0], self._twap_step_size)
+            # single writer; the slot store is atomic, so readers never see a torn value and no lock is needed
+            remaining[0] -= size
+            logger.info("TWAP update: TWAP triggered. direction: %s, size: %s, remainder: %s", self._twap_direction, size, remaining[0])
+            self._risk_manager.update_twap_delta(self._twap_sign * size)
+
+    def get_remaining_size(self) -> float:
+        """
+        position still to be added by the TWAP, unsigned. Safe to call from any thread
+        """
+        return self._twap_remaining[0]
+
+    def on_order_book_tick(self, *args, **kwargs):
+        # TWAP steps are driven by their own timer, not by order book ticks
         pass
+
+    def shutdown(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._stop_event.set()
@@ -2,27 +2,173 @@
 
 import abc
 import asyncio
-from collections import deque
 import time
+import numpy as np
 
-from typing import Any, Deque, Dict, List, Tuple, Union, Optional
+from typing import Any, Callable, Dict, List, Tuple, Union, Optional
+from lib.common.jit import njit
+
+
+@njit(cache=True)
+def _append_trades(ts, px, qty, state_ts, state_pv, state_qty, tail):
+    """
+    write a batch of trades into the SimpleVWAP columns from tail on, returns the batch (pv, volume) totals
+    """
+    end = tail + len(ts)
+    pv = px * qty
+    state_ts[tail:end] = ts
+    state_pv[tail:end] = pv
+    state_qty[tail:end] = qty
+    return pv.sum(), qty.sum()
+
+
+class SpscTradeRing:
+    """
+    Single-producer / single-consumer queue of (timestamp ms, price, amount) trades, from a feed thread to the VWAP consumer.
+    Only the producer moves _tail and only the consumer moves _head, each after it is done with the slots it covers.
+    Each index is a single attribute store, which CPython makes atomic, so neither side takes a lock.
+    """
+    def __init__(self, capacity: int = 1 << 16) -> None:
+        capacity = 1 << max(capacity - 1, 1).bit_length()     # round up to a power of two so slots are tail & mask
+        self._mask = capacity - 1
+        self._ts = np.empty(capacity, dtype=np.int64)
+        self._px = np.empty(capacity, dtype=np.float64)
+        self._qty = np.empty(capacity, dtype=np.float64)
+        self._head = 0
+        self._tail = 0
+        self.dropped = 0    # trades pushed while the ring was full
+
+    def __len__(self) -> int:
+        return self._tail - self._head
+
+    def push(self, timestamp: int, price: float, amount: float) -> bool:
+        """
+        producer side, returns False and drops the trade if the consumer has fallen a full ring behind
+        """
+        tail = self._tail
+        if tail - self._head > self._mask:
+            self.dropped += 1
+            return False
+        slot = tail & self._mask
+        self._ts[slot] = timestamp
+        self._px[slot] = price
+        self._qty[slot] = amount
+        # publish the slot only once it is fully written
+        self._tail = tail + 1
+        return True
+
+    def drain(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        consumer side, returns copies of all published trades (timestamps, prices, amounts), oldest first
+        """
+        head = self._head
+        tail = self._tail
+        slots = np.arange(head, tail) & self._mask
+        trades = self._ts[slots], self._px[slots], self._qty[slots]
+        # hand the slots back to the producer only after they are copied out
+        self._head = tail
+        return trades
+
+
+# running totals are rebuilt from the live window after this many evictions, so += / -= rounding error cannot build up
+TOTALS_RECOMPUTE_EVICTIONS = 65_536
+# shortest wait between expiry checks of a SimpleVWAP run() without a trade ring
+EXPIRY_POLL_MIN_NS = 100_000_000
 
 
 class VWAP(abc.ABC):
     
-    def __init__(self, period, get_time_nanos) -> None:
+    def __init__(self, period, get_time_nanos, get_monotonic_ns=time.monotonic_ns) -> None:
         self.period_ns = period * 1_000_000_000
         self.get_time_nanos = get_time_nanos
+        # run() schedules its wake-ups on the monotonic clock, they are never compared to exchange timestamps
+        self.get_monotonic_ns = get_monotonic_ns
         self._total_pv = 0.0
         self._total_volume = 0.0
+        self._evictions_since_recompute = 0
+        # totals the cached vwap was computed from, readers polling faster than trades arrive skip the division
+        self._cached_pv = 0.0
+        self._cached_volume = 0.0
+        self._cached_vwap: Optional[float] = None
+        # last published vwap, pushed to subscribers whenever it changes
+        self.latest: Optional[float] = None
+        self._subscribers: List[Callable[[Optional[float]], None]] = []
+
+    def subscribe(self, callback: Callable[[Optional[float]], None]) -> None:
+        """
+        register a callback invoked with the new vwap every time it changes, and once with the current value
+        """
+        self._subscribers.append(callback)
+        callback(self.latest)
+
+    def _compute_vwap(self) -> Optional[float]:
+        total_pv = self._total_pv
+        total_volume = self._total_volume
+        # unchanged totals are the same bit patterns, so exact comparison is safe
+        if total_pv == self._cached_pv and total_volume == self._cached_volume:
+            return self._cached_vwap
+        vwap = None if total_volume == 0 else total_pv / total_volume
+        self._cached_pv = total_pv
+        self._cached_volume = total_volume
+        self._cached_vwap = vwap
+        return vwap
+
+    @property
+    def next_expiry_ns(self) -> float:
+        """
+        wall clock time in ns from which the published vwap is stale until get_vwap() refreshes it, inf if it never goes stale on its own
+        """
+        return np.inf
+
+    def _publish(self) -> None:
+        vwap = self._compute_vwap()
+        if vwap != self.latest:
+            self.latest = vwap
+            for callback in self._subscribers:
+                callback(vwap)
+
+    async def _sleep_until(self, deadline_ns: int) -> int:
+        """
+        sleep until an absolute deadline, so time spent between wake-ups does not push later ones back.
+        returns the time at wake-up
+        """
+        delay_ns = deadline_ns - self.get_monotonic_ns()
+        await asyncio.sleep(max(0, delay_ns) / 1_000_000_000)
+        return self.get_monotonic_ns()
+
+    def _next_deadline(self, deadline_ns: int, current_time: int) -> int:
+        deadline_ns += self.time_resolution_ns
+        # if we fell behind by more than a time resolution, skip the missed wake-ups instead of running them back to back
+        if deadline_ns <= current_time:
+            deadline_ns = current_time + self.time_resolution_ns
+        return deadline_ns
 
-    @abc.abstractmethod
     def add_trade(self, trade: Dict[str, Any]) -> None:
+        self.add_trade_values(trade["timestamp"], trade["price"], trade["amount"])
+
+    @abc.abstractmethod
+    def add_trade_values(self, timestamp: int, price: float, amount: float) -> None:
+        """
+        add a trade from its fields, timestamp in ms. Feed handlers that already hold the fields should call this instead of add_trade
+        """
         pass
     
     def add_trades(self, trades: List[Dict[str, Any]]) -> None:
+        add_trade_values = self.add_trade_values
         for trade in trades:
-            self.add_trade(trade)
+            add_trade_values(trade["timestamp"], trade["price"], trade["amount"])
+
+    def _count_evictions(self, n: int) -> None:
+        self._evictions_since_recompute += n
+        if self._evictions_since_recompute >= TOTALS_RECOMPUTE_EVICTIONS:
+            self._evictions_since_recompute = 0
+            self._recompute_totals()
+
+    def _recompute_totals(self) -> None:
+        """
+        rebuild _total_pv / _total_volume from the live window, numpy's pairwise summation keeps the error at O(log n)
+        """
+        pass
 
     @abc.abstractmethod
     def get_vwap(self) -> Optional[float]:
@@ -35,74 +181,267 @@ class VWAP(abc.ABC):
 
 class SimpleVWAP(VWAP):
     
-    def __init__(self, period=1800, get_time_nanos=time.time_ns) -> None:
-        super().__init__(period, get_time_nanos)
-        self._trades: Deque[Dict[str, Any]] = deque()
+    def __init__(self, period=1800, get_time_nanos=time.time_ns, time_resolution_ms=1, capacity=1024, trade_ring: Optional[SpscTradeRing] = None,
+                 get_monotonic_ns=time.monotonic_ns) -> None:
+        super().__init__(period, get_time_nanos, get_monotonic_ns)
+        # trades pushed by a feed thread, drained by run()
+        self.trade_ring = trade_ring
+        # trade timestamps are in ms, so the eviction cutoff is computed in ms as well
+        self._period_ms = period * 1000
+        # expired trades are pruned at most once per time resolution
+        self.time_resolution_ns = time_resolution_ms * 1_000_000
+        self._last_prune_ns = None
+        # trades are stored column-wise, live trades are [_head, _tail), oldest first
+        self._min_capacity = capacity
+        self._ts = np.empty(capacity, dtype=np.int64)       # trade timestamps, in ms
+        self._pv = np.empty(capacity, dtype=np.float64)     # price * amount
+        self._qty = np.empty(capacity, dtype=np.float64)
+        self._head = 0
+        self._tail = 0
+        self.late_trades = 0    # trades older than the newest stored one, stamped with its timestamp instead
 
-    def add_trade(self, trade: Dict[str, Any]) -> None:
-        self._trades.append(trade)
-        self._total_pv += trade["price"] * trade["amount"]
-        self._total_volume += trade["amount"]
+    def add_trade_values(self, timestamp: int, price: float, amount: float) -> None:
+        pv = price * amount
+        tail = self._tail
+        if tail > self._head and timestamp <= self._ts[tail - 1]:
+            # same ms as the newest trade, they expire together so they can share an entry.
+            # eviction relies on _ts staying sorted, so a late trade joins the newest entry as well
+            if timestamp != self._ts[tail - 1]:
+                self.late_trades += 1
+            self._pv[tail - 1] += pv
+            self._qty[tail - 1] += amount
+        else:
+            if tail == len(self._ts):
+                self._make_room(1)
+                tail = self._tail
+            self._ts[tail] = timestamp
+            self._pv[tail] = pv
+            self._qty[tail] = amount
+            self._tail = tail + 1
+        self._total_pv += pv
+        self._total_volume += amount
         self._prune_old_trades()
+        self._publish()
+
+    def add_trades_array(self, timestamps: np.ndarray, prices: np.ndarray, amounts: np.ndarray) -> None:
+        """
+        add a batch of trades given as arrays, timestamps in ms and oldest first. Meant for replay / backtest feeds and trade ring drains
+        """
+        timestamps = np.ascontiguousarray(timestamps, dtype=np.int64)
+        prices = np.ascontiguousarray(prices, dtype=np.float64)
+        amounts = np.ascontiguousarray(amounts, dtype=np.float64)
+        n = len(timestamps)
+        if n == 0:
+            return
+        floor_ts = self._ts[self._tail - 1] if self._tail > self._head else timestamps[0]
+        if timestamps[0] < floor_ts or (timestamps[1:] < timestamps[:-1]).any():
+            # eviction relies on _ts staying sorted, late trades are stamped with the newest timestamp seen before them
+            clamped = np.maximum.accumulate(np.maximum(timestamps, floor_ts))
+            self.late_trades += int((clamped != timestamps).sum())
+            timestamps = clamped
+        if self._tail + n > len(self._ts):
+            self._make_room(n)
+        batch_pv, batch_volume = _append_trades(timestamps, prices, amounts, self._ts, self._pv, self._qty, self._tail)
+        self._tail += n
+        self._total_pv += float(batch_pv)
+        self._total_volume += float(batch_volume)
+        self._prune_old_trades()
+        self._publish()
+
+    def _make_room(self, n: int) -> None:
+        """
+        move live trades to the front of the columns so n more fit, doubling them first while they would be more than half full,
+        and halving them again after a burst while they would be less than a quarter full
+        """
+        head, tail = self._head, self._tail
+        live = tail - head
+        capacity = len(self._ts)
+        while live + n > capacity // 2:
+            capacity *= 2
+        while capacity > self._min_capacity and live + n <= capacity // 4:
+            capacity //= 2
+        for name in ("_ts", "_pv", "_qty"):
+            column = getattr(self, name)
+            new_column = column if len(column) == capacity else np.empty(capacity, dtype=column.dtype)
+            new_column[:live] = column[head:tail]
+            setattr(self, name, new_column)
+        self._head = 0
+        self._tail = live
+
+    @property
+    def next_expiry_ns(self) -> float:
+        if self._head == self._tail:
+            return np.inf
+        # the oldest trade is evicted once now rounded up to the ms is past its timestamp + period
+        return (int(self._ts[self._head]) + self._period_ms) * 1_000_000 + 1
 
     def get_vwap(self) -> Optional[float]:
         if self._total_volume == 0:
             return None
         self._prune_old_trades()
-        return self._total_pv / self._total_volume
+        self._publish()
+        return self.latest
 
     def _prune_old_trades(self) -> None:
-        cutoff_time = self.get_time_nanos() - self.period_ns
-        while self._trades and (self._trades[0]["timestamp"] * 1_000_000) < cutoff_time:
-            old_trade = self._trades.popleft()
-            self._total_pv -= old_trade["price"] * old_trade["amount"]
-            self._total_volume -= old_trade["amount"]
+        now = self.get_time_nanos()
+        if self._last_prune_ns is not None and now - self._last_prune_ns < self.time_resolution_ns:
+            return
+        self._last_prune_ns = now
+        # now rounded up to the next ms, so a trade expires exactly when its ms timestamp falls behind now - period
+        cutoff_ms = -(-now // 1_000_000) - self._period_ms
+        head, tail = self._head, self._tail
+        # trades arrive in timestamp order, so the expired ones are a prefix of the live slice
+        n_expired = int(np.searchsorted(self._ts[head:tail], cutoff_ms))
+        if n_expired == 0:
+            return
+        if n_expired == tail - head:
+            # window is empty, start the totals again from exact zeros
+            self._head = self._tail = 0
+            self._total_pv = 0.0
+            self._total_volume = 0.0
+            return
+        expired = slice(head, head + n_expired)
+        self._total_pv -= float(self._pv[expired].sum())
+        self._total_volume -= float(self._qty[expired].sum())
+        self._head = head + n_expired
+        self._count_evictions(n_expired)
+
+    def _recompute_totals(self) -> None:
+        live = slice(self._head, self._tail)
+        self._total_pv = float(self._pv[live].sum())
+        self._total_volume = float(self._qty[live].sum())
 
     async def run(self) -> None:
-        pass
+        trade_ring = self.trade_ring
+        next_drain_ns = self.get_monotonic_ns() + self.time_resolution_ns
+        while True:
+            if trade_ring is not None:
+                # the ring is drained every time resolution
+                current_time = await self._sleep_until(next_drain_ns)
+                next_drain_ns = self._next_deadline(next_drain_ns, current_time)
+                if len(trade_ring):
+                    self.add_trades_array(*trade_ring.drain())
+                    continue
+            else:
+                # trades come in through add_trade, so only wake up for the next expiry. A trade added to an empty window
+                # expires a full period later, so waking up at least once per period cannot miss it
+                wait_ns = min(max(self.next_expiry_ns - self.get_time_nanos(), EXPIRY_POLL_MIN_NS), self.period_ns)
+                await self._sleep_until(self.get_monotonic_ns() + wait_ns)
+            # trades still expire on a quiet tape, subscribers only see that if it is published from here
+            if self.get_time_nanos() >= self.next_expiry_ns:
+                self._prune_old_trades()
+                self._publish()
 
 
 class BucketedVWAP(VWAP):
     
-    def __init__(self, period=1800, time_resolution_ms=1, get_time_nanos=time.time_ns) -> None:
-        super().__init__(period, get_time_nanos)
+    def __init__(self, period=1800, time_resolution_ms=1, get_time_nanos=time.time_ns, get_monotonic_ns=time.monotonic_ns) -> None:
+        # buckets are stamped and rolled over on the monotonic clock
+        super().__init__(period, get_time_nanos, get_monotonic_ns)
         self.time_resolution_ns = time_resolution_ms * 1_000_000
-        self.buckets: Deque[Tuple[int, float, float]] = deque()
-        self._current_bucket = None
-        self.start_time_ns = None
+        # bucket ring, rows are (start time ns, pv, volume), sized for a full window of buckets.
+        # closed buckets are rows [_head, _tail) and the open bucket is row _tail, all modulo the ring size
+        self._buckets = np.zeros((int(self.period_ns // self.time_resolution_ns) + 2, 3), dtype=np.float64)
+        self._head = 0
+        self._tail = 0
+        self._open_row: int = 0                 # row of the open bucket
+        self._open_bucket(self.get_monotonic_ns())
 
-    def add_trade(self, trade: Dict[str, Any]) -> None:
-        if self._current_bucket is None:
-            return
-        self._current_bucket[1] += trade["price"] * trade["amount"]
-        self._current_bucket[2] += trade["amount"]
-        self._total_pv += trade["price"] * trade["amount"]
-        self._total_volume += trade["amount"]
+    def add_trade_values(self, timestamp: int, price: float, amount: float) -> None:
+        open_row = self._open_row
+        pv = price * amount
+        buckets = self._buckets
+        buckets[open_row, 1] += pv
+        buckets[open_row, 2] += amount
+        self._total_pv += pv
+        self._total_volume += amount
+        self._publish()
 
     def get_vwap(self) -> Optional[float]:
-        if self._total_volume == 0:
-            return None
-        return self._total_pv / self._total_volume
+        return self._compute_vwap()
 
-    async def run(self):
-        self.start_time_ns = self.get_time_nanos()
-        self._current_bucket = [self.get_time_nanos(), 0.0, 0.0]
+    def _open_bucket(self, current_time: int) -> None:
+        self._open_row = self._tail % len(self._buckets)
+        self._buckets[self._open_row] = (current_time, 0.0, 0.0)
+
+    def _grow_buckets(self) -> None:
+        """
+        double the ring, only needed if rollovers came faster than the time resolution
+        """
+        size = len(self._buckets)
+        rows = np.arange(self._head, self._tail + 1) % size
+        grown = np.zeros((2 * size, 3), dtype=np.float64)
+        grown[:len(rows)] = self._buckets[rows]
+        self._buckets = grown
+        self._tail -= self._head
+        self._head = 0
 
-        # Handle the initial period
+    async def run(self):
+        next_rollover_ns = self.get_monotonic_ns() + self.time_resolution_ns
+        # during the first period nothing is old enough to evict yet, so the same loop covers warm-up
         while True:
-            await asyncio.sleep(self.time_resolution_ns / 1_000_000_000)
-            current_time = self.get_time_nanos()
-            if current_time - self.start_time_ns >= self.period_ns:
+            current_time = await self._sleep_until(next_rollover_ns)
+            next_rollover_ns = self._next_deadline(next_rollover_ns, current_time)
+            self._roll_over(current_time, current_time - self.period_ns)
+
+    def _roll_over(self, current_time: int, cutoff_time: int) -> None:
+        if self._buckets[self._open_row, 2] == 0.0:
+            # nothing traded, keep reusing the open row instead of closing an empty bucket
+            self._buckets[self._open_row, 0] = current_time
+        else:
+            # close the open bucket and open the next row
+            if self._tail + 1 - self._head >= len(self._buckets):
+                self._grow_buckets()
+            self._tail += 1
+            self._open_bucket(current_time)
+        self._evict_buckets(cutoff_time)
+        self._publish()
+
+    def _evict_buckets(self, cutoff_time: int) -> None:
+        """
+        drop closed buckets that started before cutoff_time, all at once
+        """
+        head, tail = self._head, self._tail
+        if head == tail:
+            return
+        buckets = self._buckets
+        size = len(buckets)
+        start = head % size
+        end = start + tail - head
+        # closed buckets are in start time order, possibly wrapping around the end of the ring
+        if end <= size:
+            segments = (buckets[start:end],)
+        else:
+            segments = (buckets[start:], buckets[:end - size])
+        n_expired = 0
+        for segment in segments:
+            n = int(np.searchsorted(segment[:, 0], cutoff_time))
+            if n:
+                expired = segment[:n].sum(axis=0)
+                self._total_pv -= float(expired[1])
+                self._total_volume -= float(expired[2])
+                n_expired += n
+            if n < len(segment):
                 break
-            self._current_bucket = [current_time, 0.0, 0.0]
+        if n_expired == 0:
+            return
+        self._head = head + n_expired
+        if self._head == tail:
+            # only the open bucket is left, take the totals from it exactly
+            self._total_pv = float(buckets[self._open_row, 1])
+            self._total_volume = float(buckets[self._open_row, 2])
+        else:
+            self._count_evictions(n_expired)
 
-        # Continue with bucket management
-        while True:
-            await asyncio.sleep(self.time_resolution_ns / 1_000_000_000)
-            current_time = self.get_time_nanos()
-            self.buckets.append(self._current_bucket)
-            self._current_bucket = [current_time, 0.0, 0.0]
-            while self.buckets and self.buckets[0][0] < current_time - self.period_ns:
-                old_bucket = self.buckets.popleft()
-                self._total_pv -= old_bucket[1]
-                self._total_volume -= old_bucket[2]
\ No newline at end of file
+    def _recompute_totals(self) -> None:
+        # closed buckets and the open one, summed as one or two contiguous slices of the ring without copying rows out
+        buckets = self._buckets
+        size = len(buckets)
+        start = self._head % size
+        end = start + self._tail + 1 - self._head
+        if end <= size:
+            totals = buckets[start:end, 1:].sum(axis=0)
+        else:
+            totals = buckets[start:, 1:].sum(axis=0) + buckets[:end - size, 1:].sum(axis=0)
+        self._total_pv = float(totals[0])
+        self._total_volume = float(totals[1])